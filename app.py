@@ -3,10 +3,21 @@
 Swarm Homepage - A service discovery dashboard for Docker Swarm with Traefik
 """
 import os
+import re
+import sys
+import atexit
+import time
 import logging
-import requests
-from flask import Flask, render_template, jsonify
+import hashlib
+import threading
+from operator import attrgetter
+from dataclasses import dataclass
+import httpx
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, render_template, request
 import docker
+from waitress import serve
 from typing import List, Dict, Optional
 
 # Configure logging
@@ -22,19 +33,105 @@ app = Flask(__name__)
 TRAEFIK_API_URL = os.getenv('TRAEFIK_API_URL', 'http://traefik:8080/api')
 DOCKER_SOCKET = os.getenv('DOCKER_SOCKET', 'unix://var/run/docker.sock')
 REFRESH_INTERVAL = int(os.getenv('REFRESH_INTERVAL', '60'))
+FULL_REFRESH_INTERVAL = int(os.getenv('FULL_REFRESH_INTERVAL', '600'))
+
+# Shared string constants for discovered service records
+DEFAULT_CATEGORY = sys.intern('Services')
+HTTP = sys.intern('http')
+HTTPS = sys.intern('https')
+
+# Label prefixes, checked once per label
+ROUTER_PREFIX = 'traefik.http.routers.'
+SERVICE_PREFIX = 'traefik.http.services.'
+HOMEPAGE_PREFIX = 'homepage.'
+SWARM_HOMEPAGE_PREFIX = 'swarm.homepage.'
+HOMEPAGE_PREFIXES = (HOMEPAGE_PREFIX, SWARM_HOMEPAGE_PREFIX)
+
+# First hostname of a Traefik rule like "Host(`example.com`)"
+HOST_RULE_RE = re.compile(r'Host\(\s*[`"]([^`"]+)[`"]')
+
+# Traefik API calls run here, beside the Docker call on the requesting thread
+discovery_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='discovery')
+
+# Cap concurrent calls to the Traefik API so a slow API is not piled on
+traefik_semaphore = threading.BoundedSemaphore(2)
+
+# Cache lookup sentinel, since None is a valid cached value
+MISSING = object()
+
+
+def url_hostname(url: str) -> str:
+    """Get the hostname from a URL like scheme://user@host:port/path"""
+    netloc = url.split('://', 1)[-1].split('/', 1)[0]
+    host = netloc.rpartition('@')[2]
+    if host.startswith('['):
+        # IPv6 literal like [::1]:8080
+        return host[1:].partition(']')[0].lower()
+    return host.partition(':')[0].lower()
+
+
+@dataclass(frozen=True, slots=True)
+class Service:
+    """A discovered service shown on the homepage"""
+    name: str
+    url: str
+    description: str = ''
+    icon: str = ''
+    category: str = DEFAULT_CATEGORY
 
 
 class ServiceDiscovery:
     """Service discovery handler for Docker Swarm and Traefik"""
     
-    def __init__(self, docker_socket: str, traefik_api_url: str):
+    def __init__(self, docker_socket: str, traefik_api_url: str, cache_ttl: int = REFRESH_INTERVAL):
         self.docker_socket = docker_socket
         self.traefik_api_url = traefik_api_url
         self.docker_client = None
+        self.cache_ttl = cache_ttl
+        # (timestamp, serialized JSON body) of the last discovery run
+        self._cache = None
+        self._cache_lock = threading.Lock()
+        # Set once a background thread keeps the cache warm
+        self._refresh_thread = None
+        self._refresh_wakeup = threading.Event()
+        # Default descriptions by hostname, reused across refreshes
+        self._desc_cache: Dict[str, str] = {}
+        # Last successful Traefik API result, served when the API is busy
+        self._traefik_services: List[Service] = []
+        # Traefik-enabled Docker services by service ID, kept in sync by the
+        # event stream between full listings
+        self._service_cache: Dict[str, Service] = {}
+        self._service_cache_time = None
+        # Bumped by every applied event so a full listing can tell whether
+        # events arrived while it was running
+        self._service_cache_generation = 0
+        self._service_cache_lock = threading.Lock()
+        # Extracted service info by (name, labels), so unchanged services are
+        # not re-parsed; pruned to the listed services on each full listing
+        self._info_cache: Dict[tuple, Optional[Service]] = {}
+        self._events_active = False
+        self._event_stream = None
+        self._event_thread = None
+        self._stopping = threading.Event()
+        # Keep-alive client so Traefik API calls reuse pooled connections
+        # (HTTP/2 is negotiated when the API is served over TLS)
+        self.http = httpx.Client(
+            http2=True,
+            timeout=httpx.Timeout(4.0, connect=1.0),
+            limits=httpx.Limits(max_connections=4)
+        )
         self._init_docker_client()
     
     def _init_docker_client(self):
-        """Initialize Docker client"""
+        """Initialize Docker client, reusing the existing one while it still responds"""
+        if self.docker_client:
+            try:
+                self.docker_client.ping()
+                return
+            except Exception as e:
+                logger.warning(f"Docker client is stale, reconnecting: {e}")
+                self._close_docker_client()
+        
         try:
             self.docker_client = docker.DockerClient(base_url=self.docker_socket)
             self.docker_client.ping()
@@ -43,101 +140,252 @@ class ServiceDiscovery:
             logger.error(f"Failed to initialize Docker client: {e}")
             self.docker_client = None
     
-    def get_services_from_docker(self) -> List[Dict]:
+    def _close_docker_client(self):
+        """Close the Docker client and drop the reference"""
+        try:
+            self.docker_client.close()
+        except Exception as e:
+            logger.debug(f"Error closing Docker client: {e}")
+        self.docker_client = None
+    
+    def close(self):
+        """Stop background threads and release the Docker and HTTP clients"""
+        self._stopping.set()
+        self._refresh_wakeup.set()
+        if self._event_stream:
+            self._event_stream.close()
+        if self.docker_client:
+            self._close_docker_client()
+        self.http.close()
+    
+    def get_services_from_docker(self) -> List[Service]:
         """Get services from Docker labels"""
         services = []
         
+        if not self.docker_client:
+            self._init_docker_client()
         if not self.docker_client:
             logger.warning("Docker client not available")
             return services
         
+        # While the event stream keeps the cache current, only re-list
+        # services every FULL_REFRESH_INTERVAL seconds as a safety net
+        with self._service_cache_lock:
+            if (self._events_active and self._service_cache_time is not None
+                    and time.monotonic() - self._service_cache_time < FULL_REFRESH_INTERVAL):
+                return list(self._service_cache.values())
+        
         try:
-            # Get all services (Docker Swarm)
-            swarm_services = self.docker_client.services.list()
-            logger.info(f"Found {len(swarm_services)} services to review")
+            timestamp = time.monotonic()
+            with self._service_cache_lock:
+                generation = self._service_cache_generation
+            # Get Traefik-enabled services (Docker Swarm), filtered by dockerd
+            swarm_services = self.docker_client.services.list(filters={'label': 'traefik.enable=true'})
+            service_cache = {}
+            info_cache = {}
             for service in swarm_services:
-                # Get labels from service spec
-                labels = service.attrs.get('Spec', {}).get('Labels', {})
-                
                 # Look for Traefik labels
-                service_info = self._extract_service_info(service.name, labels)
+                service_info = self._service_info_from_swarm(service, info_cache)
                 if service_info:
-                    services.append(service_info)
+                    service_cache[service.id] = service_info
             
-            logger.info(f"Found {len(services)} services from Docker")
+            self._info_cache = info_cache
+            with self._service_cache_lock:
+                self._service_cache = service_cache
+                # Events applied during the listing may be missing from it;
+                # leave the listing stale so the next refresh lists again
+                if self._service_cache_generation == generation:
+                    self._service_cache_time = timestamp
+                else:
+                    self._service_cache_time = None
+            services = list(service_cache.values())
+            
+            logger.info(f"Found {len(services)} services from Docker out of {len(swarm_services)} reviewed")
         except Exception as e:
             logger.error(f"Error getting services from Docker: {e}")
+            # Check the connection so the next refresh uses a working client
+            self._init_docker_client()
         
         return services
     
-    def _extract_service_info(self, service_name: str, labels: Dict) -> Optional[Dict]:
+    def _service_info_from_swarm(self, service, info_cache: Optional[Dict] = None) -> Optional[Service]:
+        """Extract service information from a Docker Swarm service, reusing the
+        previous result while its name and labels are unchanged"""
+        # Get name and labels from service spec
+        spec = service.attrs.get('Spec', {})
+        labels = spec.get('Labels') or {}
+        name = spec.get('Name', service.name)
+        
+        # Bind the cache once: a full listing may swap in a new one meanwhile
+        cache = self._info_cache
+        key = (name, frozenset(labels.items()))
+        service_info = cache.get(key, MISSING)
+        if service_info is MISSING:
+            service_info = self._extract_service_info(name, labels)
+        
+        if info_cache is None:
+            info_cache = cache
+        info_cache[key] = service_info
+        return service_info
+    
+    def start_event_watch(self):
+        """Start a background thread that applies Docker service events to the service cache"""
+        if self._event_thread and self._event_thread.is_alive():
+            return
+        self._event_thread = threading.Thread(target=self._watch_events, name='docker-events', daemon=True)
+        self._event_thread.start()
+    
+    def _watch_events(self):
+        """Follow the Docker service event stream, reconnecting when it drops"""
+        while not self._stopping.is_set():
+            if self.docker_client:
+                try:
+                    self._event_stream = self.docker_client.events(decode=True, filters={'type': 'service'})
+                    # Force a full listing so changes made before the stream
+                    # opened are not missed
+                    with self._service_cache_lock:
+                        self._service_cache_time = None
+                        self._events_active = True
+                    for event in self._event_stream:
+                        self._apply_service_event(event)
+                except Exception as e:
+                    if not self._stopping.is_set():
+                        logger.warning(f"Docker event stream interrupted: {e}")
+                finally:
+                    self._events_active = False
+            self._stopping.wait(5)
+    
+    def _apply_service_event(self, event: Dict):
+        """Update the service cache from a single Docker service event"""
+        service_id = event.get('Actor', {}).get('ID')
+        if not service_id:
+            return
+        
+        service_info = None
+        if event.get('Action') != 'remove':
+            try:
+                service_info = self._service_info_from_swarm(self.docker_client.services.get(service_id))
+            except docker.errors.NotFound:
+                pass
+        
+        with self._service_cache_lock:
+            if service_info:
+                self._service_cache[service_id] = service_info
+            else:
+                self._service_cache.pop(service_id, None)
+            self._service_cache_generation += 1
+        
+        self._invalidate_cache()
+    
+    def _extract_service_info(self, service_name: str, labels: Dict) -> Optional[Service]:
         """Extract service information from service labels"""
         # Check if Traefik is enabled
         traefik_enabled = labels.get('traefik.enable', '').lower() == 'true'
-        logger.info(f"Traefik enabled for {service_name}")
         if not traefik_enabled:
             return None
         
+        # Per-service logging is only formatted when debug output is enabled
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug(f"Traefik enabled for {service_name}")
+        
         # Try to find service URL from various Traefik label formats
         service_url = None
+        hostname = None
         display_name = service_name
         
-        # Check for common Traefik label patterns
+        # Single pass over the labels: collect router rule/tls values by router
+        # name, homepage.* / swarm.homepage.* options, and the service name
+        # from load balancer labels
+        routers = {}
+        homepage = {}
+        swarm_homepage = {}
         for key, value in labels.items():
-            # Look for router rule with Host
-            if 'traefik.http.routers' in key and '.rule' in key:
-                # Extract hostname from rule like "Host(`example.com`)"
-                logger.info("Found http.routers, extracting hostname from Host rule")
-                if 'Host(' in value:
-                    hostname = value.split('Host(')[1].split(')')[0].strip('`').strip('"')
-                    # Determine protocol
-                    protocol = 'https' if 'https' in key or labels.get(key.replace('.rule', '.tls'), '') else 'http'
-                    service_url = f"{protocol}://{hostname}"
-                    logger.info(f"Got service URL {service_url}")
-            
-            # Look for service name
-            if 'traefik.http.services' in key and '.loadbalancer' in key:
+            if key.startswith(ROUTER_PREFIX):
+                # traefik.http.routers.<name>.<option>
+                parts = key.split('.', 4)
+                if len(parts) == 5 and parts[4] in ('rule', 'tls'):
+                    routers.setdefault(parts[3], {})[parts[4]] = value
+            elif key.startswith(SERVICE_PREFIX) and '.loadbalancer' in key:
                 display_name = key.split('.')[3]  # Extract service name from label
+            elif key.startswith(HOMEPAGE_PREFIXES):
+                if key.startswith(HOMEPAGE_PREFIX):
+                    homepage[key[len(HOMEPAGE_PREFIX):]] = value
+                else:
+                    swarm_homepage[key[len(SWARM_HOMEPAGE_PREFIX):]] = value
+        
+        # homepage.* labels take precedence over swarm.homepage.* labels
+        if swarm_homepage:
+            swarm_homepage.update(homepage)
+            homepage = swarm_homepage
+        
+        # Fast path: Traefik-enabled services without HTTP routers (TCP
+        # services, middlewares only) and no homepage URL are skipped before
+        # any further parsing
+        if not routers and not homepage.get('url'):
+            if debug:
+                logger.debug(f"No HTTP router or homepage URL for {service_name}")
+            return None
+        
+        # Look for router rule with Host
+        for router_name, router in routers.items():
+            if debug:
+                logger.debug(f"Found router {router_name}, extracting hostname from Host rule")
+            match = HOST_RULE_RE.search(router.get('rule', ''))
+            if match:
+                hostname = match.group(1)
+                # Determine protocol
+                protocol = HTTPS if 'https' in router_name or router.get('tls') else HTTP
+                service_url = f"{protocol}://{hostname}"
+                if debug:
+                    logger.debug(f"Got service URL {service_url}")
         
         # Fallback: check for custom homepage labels
         if not service_url:
-            service_url = labels.get('homepage.url', labels.get('swarm.homepage.url', ''))
-            logger.info("no service url found")
-        
-        if service_url:
+            service_url = homepage.get('url', '')
+            if not service_url:
+                return None
             # Extract hostname for default description
-            try:
-                from urllib.parse import urlparse
-                parsed_url = urlparse(service_url)
-                hostname = parsed_url.hostname or parsed_url.netloc
-            except Exception:
-                hostname = service_url
-            
-            # Get values with defaults
-            name = labels.get('homepage.name', labels.get('swarm.homepage.name', display_name))
-            description = labels.get('homepage.description', labels.get('swarm.homepage.description', ''))
-            
-            # If no description provided, create a default one
-            if not description:
-                description = f'Service available at {hostname}'
-            
-            return {
-                'name': name,
-                'url': service_url,
-                'description': description,
-                'icon': labels.get('homepage.icon', labels.get('swarm.homepage.icon', '')),
-                'category': labels.get('homepage.category', labels.get('swarm.homepage.category', 'Services'))
-            }
-        
-        return None
-    
-    def get_services_from_traefik(self) -> List[Dict]:
-        """Get services from Traefik API"""
+            hostname = url_hostname(service_url)
+            if debug:
+                logger.debug(f"No router service URL found for {service_name}")
+        
+        # Get values with defaults
+        name = homepage.get('name', display_name)
+        description = homepage.get('description', '')
+        
+        # If no description provided, create a default one
+        if not description:
+            description = self._default_description(hostname)
+        
+        category = homepage.get('category', DEFAULT_CATEGORY)
+        
+        return Service(
+            name=sys.intern(name),
+            url=service_url,
+            description=description,
+            icon=homepage.get('icon', ''),
+            category=sys.intern(category)
+        )
+    
+    def _default_description(self, hostname: str) -> str:
+        """Get the default description for a hostname, building it only once"""
+        description = self._desc_cache.get(hostname)
+        if description is None:
+            description = self._desc_cache[hostname] = f'Service available at {hostname}'
+        return description
+    
+    def _fetch_traefik_services(self) -> List[Service]:
+        """Fetch services from Traefik API, raising on failure"""
         services = []
         
+        if not traefik_semaphore.acquire(timeout=0.5):
+            logger.warning("Traefik API calls already in flight, using last known services")
+            return self._traefik_services
+        
         try:
             # Try to get routers from Traefik API
-            response = requests.get(f"{self.traefik_api_url}/http/routers", timeout=5)
+            response = self.http.get(f"{self.traefik_api_url}/http/routers")
             response.raise_for_status()
             routers = response.json()
             
@@ -146,69 +394,165 @@ class ServiceDiscovery:
                 if router.get('name', '').startswith('api@'):
                     continue
                 
-                rule = router.get('rule', '')
-                if 'Host(' in rule:
-                    hostname = rule.split('Host(')[1].split(')')[0].strip('`').strip('"')
-                    protocol = 'https' if router.get('tls') else 'http'
+                match = HOST_RULE_RE.search(router.get('rule', ''))
+                if match:
+                    hostname = match.group(1)
+                    protocol = HTTPS if router.get('tls') else HTTP
                     
-                    services.append({
-                        'name': router.get('name', hostname).split('@')[0],
-                        'url': f"{protocol}://{hostname}",
-                        'description': '',
-                        'icon': '',
-                        'category': 'Services'
-                    })
+                    services.append(Service(
+                        name=sys.intern(router.get('name', hostname).split('@')[0]),
+                        url=f"{protocol}://{hostname}"
+                    ))
             
-            logger.info(f"Found {len(services)} services from Traefik API")
-        except Exception as e:
-            logger.warning(f"Could not fetch services from Traefik API: {e}")
+            self._traefik_services = services
+        finally:
+            traefik_semaphore.release()
         
         return services
     
-    def discover_services(self) -> List[Dict]:
+    def discover_services(self) -> List[Service]:
         """Discover all services"""
-        # Try Docker first (more detailed information from labels)
+        # Query Traefik in the background while Docker is queried on this
+        # thread, so a slow Docker socket does not delay the Traefik fallback
+        # and a slow Traefik API never delays the Docker result
+        traefik_future = discovery_executor.submit(self._fetch_traefik_services)
+        
+        # Prefer Docker (more detailed information from labels)
         services = self.get_services_from_docker()
         
-        # If Docker fails or returns nothing, try Traefik API
-        if not services:
-            services = self.get_services_from_traefik()
+        if services:
+            # The Traefik call is left to finish; its result is not needed
+            traefik_future.add_done_callback(self._discard_traefik_result)
+        else:
+            # If Docker fails or returns nothing, use the Traefik API results
+            try:
+                services = traefik_future.result()
+                logger.info(f"Found {len(services)} services from Traefik API")
+            except Exception as e:
+                logger.warning(f"Could not fetch services from Traefik API: {e}")
+                services = []
         
         # Remove duplicates and sort
-        unique_services = {}
+        seen_urls = set()
+        unique_services = []
         for service in services:
-            key = service['url']
-            if key not in unique_services:
-                unique_services[key] = service
+            if service.url not in seen_urls:
+                seen_urls.add(service.url)
+                unique_services.append(service)
+        
+        unique_services.sort(key=attrgetter('category', 'name'))
         
-        sorted_services = sorted(unique_services.values(), key=lambda x: (x['category'], x['name']))
+        return unique_services
+    
+    def _discard_traefik_result(self, future):
+        """Log the outcome of an unused Traefik API call at debug level"""
+        error = future.exception()
+        if error:
+            logger.debug(f"Unused Traefik API call failed: {error}")
+    
+    def _cache_fresh(self, cached) -> bool:
+        """Check whether a cache entry is still within its TTL"""
+        return cached is not None and time.monotonic() - cached[0] < self.cache_ttl
+    
+    def _invalidate_cache(self):
+        """Make the next request see a fresh discovery result"""
+        if self._refresh_thread:
+            # Keep serving the current body until the refresh loop replaces it
+            self._refresh_wakeup.set()
+        else:
+            self._cache = None
+    
+    def _refresh_cache(self) -> bytes:
+        """Run discovery and replace the cached JSON body; caller holds the cache lock"""
+        # Timestamp before discovery so the entry never outlives its TTL
+        timestamp = time.monotonic()
+        body = orjson.dumps(self.discover_services())
+        self._cache = (timestamp, body)
+        return body
+    
+    def start_refresh_loop(self):
+        """Start a background thread that re-runs discovery every cache_ttl seconds"""
+        if self._refresh_thread and self._refresh_thread.is_alive():
+            return
+        self._refresh_thread = threading.Thread(target=self._refresh_loop, name='discovery-refresh', daemon=True)
+        self._refresh_thread.start()
+    
+    def _refresh_loop(self):
+        """Keep the cached JSON body warm so requests never wait on discovery"""
+        while not self._stopping.is_set():
+            try:
+                with self._cache_lock:
+                    self._refresh_cache()
+            except Exception as e:
+                logger.error(f"Error refreshing services: {e}")
+            self._refresh_wakeup.wait(self.cache_ttl)
+            self._refresh_wakeup.clear()
+    
+    def get_services_json(self) -> bytes:
+        """Get discovered services as a JSON body, cached for cache_ttl seconds"""
+        cached = self._cache
+        # With the refresh loop running any cached body is current enough
+        if cached is not None and (self._refresh_thread or self._cache_fresh(cached)):
+            return cached[1]
         
-        return sorted_services
+        # Only one thread re-discovers at a time; the others serve the stale
+        # body if there is one, or wait for the refresh if there is not
+        if not self._cache_lock.acquire(blocking=cached is None):
+            return cached[1]
+        try:
+            cached = self._cache
+            if self._cache_fresh(cached) or (cached is not None and self._refresh_thread):
+                return cached[1]
+            
+            return self._refresh_cache()
+        finally:
+            self._cache_lock.release()
 
 
 # Initialize service discovery
 discovery = ServiceDiscovery(DOCKER_SOCKET, TRAEFIK_API_URL)
+atexit.register(discovery.close)
+
+
+# Health check response body, constant for the life of the process
+HEALTH_BODY = b'{"status":"healthy"}'
+
+# Rendered homepage and its ETag, built once since REFRESH_INTERVAL is its
+# only input and is fixed at startup
+index_page = None
 
 
 @app.route('/')
 def index():
     """Render the homepage"""
-    return render_template('index.html', refresh_interval=REFRESH_INTERVAL)
+    global index_page
+    if index_page is None:
+        html = render_template('index.html', refresh_interval=REFRESH_INTERVAL).encode('utf-8')
+        index_page = (html, hashlib.sha1(html).hexdigest())
+    
+    html, etag = index_page
+    response = Response(html, mimetype='text/html')
+    response.set_etag(etag)
+    response.cache_control.max_age = REFRESH_INTERVAL
+    return response.make_conditional(request)
 
 
 @app.route('/api/services')
 def get_services():
     """API endpoint to get discovered services"""
-    services = discovery.discover_services()
-    return jsonify(services)
+    return Response(discovery.get_services_json(), mimetype='application/json')
 
 
 @app.route('/health')
 def health():
     """Health check endpoint"""
-    return jsonify({'status': 'healthy'})
+    return Response(HEALTH_BODY, mimetype='application/json')
 
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', '5000'))
-    app.run(host='0.0.0.0', port=port, debug=False)
+    # Keep the service list warm in the background while serving
+    discovery.start_event_watch()
+    discovery.start_refresh_loop()
+    # Serve with a threaded WSGI server so requests are handled concurrently
+    serve(app, host='0.0.0.0', port=port, threads=8)